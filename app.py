@@ -4,15 +4,28 @@ import csv
 import time
 import re
 import json
+import random
+import queue
+import hashlib
+import sqlite3
+import statistics
 import zipfile
+import tempfile
+import threading
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Dict, List, Optional, Set, Tuple
-from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass, field
 
+import httpx
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from notion_client import Client
-from notion_client.errors import APIResponseError
+from notion_client.errors import HTTPResponseError
+import orjson
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Page config
@@ -29,6 +42,11 @@ try:
         "APP_PASSWORD",
         "NOTION_PROPERTY_NAME",
         "MAX_CONTENT_CHARS",   # ÚJ
+        "EXPORT_WORKERS",
+        "PAGE_WORKERS",
+        "BLOCK_WORKERS",
+        "NOTION_RPS",
+        "NOTION_BURST",
     ):
         if k in st.secrets and not os.getenv(k):
             os.environ[k] = str(st.secrets[k])
@@ -49,14 +67,41 @@ def _parse_int(s: str, default: int) -> int:
         return int(str(s).strip())
     except Exception:
         return default
+def _parse_float(s: str, default: float) -> float:
+    try:
+        return float(str(s).strip())
+    except Exception:
+        return default
 MAX_CONTENT_CHARS = _parse_int(os.getenv("MAX_CONTENT_CHARS", "40000"), 40000)
+# párhuzamosan exportált csoportok száma (a Notion ~3 kérés/s limitje miatt ne legyen túl nagy)
+EXPORT_WORKERS = max(1, _parse_int(os.getenv("EXPORT_WORKERS", "4"), 4))
+# csoporton belül párhuzamosan letöltött oldalak száma
+PAGE_WORKERS = max(1, _parse_int(os.getenv("PAGE_WORKERS", "5"), 5))
+# Notion kéréskorlát (token bucket): átlagos kérés/s és löket
+NOTION_RPS = _parse_float(os.getenv("NOTION_RPS", "3"), 3.0)
+NOTION_BURST = max(1, _parse_int(os.getenv("NOTION_BURST", "6"), 6))
+# oldalon belül, blokkfa-szintenként párhuzamosan lekért gyerek-listák száma
+BLOCK_WORKERS = max(1, _parse_int(os.getenv("BLOCK_WORKERS", "4"), 4))
 
 DISPLAY_RENAMES: Dict[str, str] = {
     "Üzleti Modellek": "Milyen vállalkozást indíts",
     "Marketing rendszerek": "Ügyfélszerző marketing rendszerek",
 }
+# új megjelenített név → régi nevek (a DISPLAY_RENAMES statikus, elég egyszer felépíteni)
+REVERSE_ALIAS: Dict[str, Set[str]] = {}
+for _old, _new in DISPLAY_RENAMES.items():
+    REVERSE_ALIAS.setdefault(_new, set()).add(_old)
 CSV_FIELDNAMES = ["oldal_cime", "szakasz", "sorszam", "tartalom"]
+UNIFIED_FIELDNAMES = ["course", "oldal_cime", "szakasz", "sorszam", "section_type", "tartalom"]
 EXPORTS_ROOT = "exports"
+PAGE_CACHE_PATH = os.path.join(EXPORTS_ROOT, "page_cache.sqlite3")
+# a cache-ben utófeldolgozott (fix_numbered_lists + clean_markdown) tartalom van: ha ezek kimenete változik, emeld
+PAGE_CACHE_VERSION = 1
+# ennyi hibás csoport fölött (az összes arányában, de legalább FAIL_FAST_MIN) a ZIP-es futás leáll
+FAIL_FAST_RATIO = 0.25
+FAIL_FAST_MIN = 3
+# ennél régebbi félbemaradt futást nem folytatunk (közben változhatott a Notion tartalom), újat indítunk
+CHECKPOINT_MAX_AGE_H = 24.0
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Auth
@@ -82,16 +127,34 @@ def login_form() -> None:
 # ────────────────────────────────────────────────────────────────────────────────
 # Notion client + schema
 # ────────────────────────────────────────────────────────────────────────────────
+# a notion_client httpx-et használ; egy közös, keep-alive kapcsolatkészlet
+# spórolja meg a TCP/TLS kézfogást a sok blocks.children.list hívásnál
+HTTP_POOL_SIZE = 16
+
+def _orjson_response(response: httpx.Response) -> None:
+    """httpx válasz-hook: a notion_client `response.json()` hívását orjson-ra cseréli (csak ezen a kliensen)."""
+    response.json = lambda **_: orjson.loads(response.read())
+
 @st.cache_resource
 def get_client() -> Client:
     if not NOTION_API_KEY:
         raise RuntimeError("Hiányzó NOTION_API_KEY")
-    return Client(auth=NOTION_API_KEY)
+    http = httpx.Client(limits=httpx.Limits(
+        max_connections=HTTP_POOL_SIZE,
+        max_keepalive_connections=HTTP_POOL_SIZE,
+    ), event_hooks={"response": [_orjson_response]})
+    return Client(auth=NOTION_API_KEY, client=http)
 
 @st.cache_data(ttl=120)
 def get_database_schema() -> Dict:
     client = get_client()
-    return client.databases.retrieve(database_id=DATABASE_ID)
+    return with_backoff(client.databases.retrieve, database_id=DATABASE_ID)
+
+@st.cache_data(ttl=300)
+def schema_version_token() -> str:
+    """A property-séma lenyomata; cache-kulcsba téve a sémamódosítás érvényteleníti a tárolt exportot."""
+    props = get_database_schema().get("properties", {}) or {}
+    return hashlib.sha1(json.dumps(props, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
 
 @st.cache_data(ttl=300)
 def get_property_type() -> str:
@@ -117,221 +180,289 @@ def schema_id_to_current_name() -> Dict[str, str]:
             res[o["id"]] = (o.get("name") or "").strip()
     return res
 
+def _thread_pool(max_workers: int) -> ThreadPoolExecutor:
+    """Szálkészlet, amelynek workerei öröklik a futó script kontextusát (st.cache_* szálból is működik)."""
+    run_ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(
+        max_workers=max(1, max_workers),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), run_ctx),
+    )
+
+class _TokenBucket:
+    """Szálbiztos token bucket: átlagosan `rate` kérés/s, legfeljebb `burst` egyszerre."""
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(0.1, rate)
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# minden Notion hívás ezen megy át, így a párhuzamos letöltők együtt sem lépik túl a limitet;
+# cache_resource: egy példány a folyamatban (mint a közös kliens), nem újrafutásonként vagy munkamenetenként
+@st.cache_resource
+def get_notion_bucket() -> _TokenBucket:
+    return _TokenBucket(NOTION_RPS, NOTION_BURST)
+
+def _retry_after(e: HTTPResponseError) -> float:
+    try:
+        return float((getattr(e, "headers", None) or {}).get("retry-after") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+# átmeneti hibák: rate limit + 5xx; a várakozás exponenciális (felső korláttal) + jitter, de legalább Retry-After.
+# HTTPResponseError-t fogunk (az APIResponseError alaposztálya): az ismeretlen hibakódú válaszokat
+# (pl. 504, HTML-es 502 az edge-ről) a notion_client csak így dobja
+_TRANSIENT_STATUS = frozenset({429, 500, 502, 503, 504})
+BACKOFF_TRIES = 8
+BACKOFF_MAX_SLEEP = 60.0
+
 def with_backoff(fn, *args, **kwargs):
-    for i in range(6):
+    for i in range(BACKOFF_TRIES):
+        get_notion_bucket().acquire()
         try:
             return fn(*args, **kwargs)
-        except APIResponseError as e:
+        except HTTPResponseError as e:
             status = getattr(e, "status", None)
-            if status in (429, 500, 502, 503):
-                time.sleep((2 ** i) + 0.1)
+            if status in _TRANSIENT_STATUS and i < BACKOFF_TRIES - 1:
+                time.sleep(max(_retry_after(e), min(BACKOFF_MAX_SLEEP, 2 ** i) + random.uniform(0, 0.5)))
                 continue
             raise
 
-def query_all_pages() -> List[Dict]:
+def iter_all_pages(sorts: Optional[List[Dict]] = None) -> Iterator[Dict]:
+    """Az adatbázis oldalai lapozásonként; a feldolgozás már az első válasz után indulhat.
+    A következő lapot a háttérben már kérjük, amíg a hívó az aktuálisat dolgozza fel."""
     client = get_client()
-    results: List[Dict] = []
-    cursor = None
-    while True:
-        resp = with_backoff(client.databases.query, database_id=DATABASE_ID, start_cursor=cursor, page_size=100)
-        results.extend(resp.get("results", []) or [])
-        if not resp.get("has_more"):
-            break
-        cursor = resp.get("next_cursor")
-    return results
-
-def query_filtered_pages(filter_: Dict, sorts: Optional[List[Dict]] = None) -> List[Dict]:
-    client = get_client()
-    results: List[Dict] = []
-    cursor = None
-    while True:
-        kwargs = {
-            "database_id": DATABASE_ID,
-            "filter": filter_,
-            "page_size": 100,
-            "start_cursor": cursor
-        }
-        if sorts:
-            kwargs["sorts"] = sorts
-        resp = with_backoff(client.databases.query, **kwargs)
-        results.extend(resp.get("results", []) or [])
-        if not resp.get("has_more"):
-            break
-        cursor = resp.get("next_cursor")
-    return results
+    extra = {"sorts": sorts} if sorts else {}
+    query = lambda cursor: with_backoff(client.databases.query, database_id=DATABASE_ID, start_cursor=cursor, page_size=100, **extra)
+    resp = query(None)
+    with _thread_pool(1) as ex:
+        while True:
+            nxt = ex.submit(query, resp.get("next_cursor")) if resp.get("has_more") else None
+            yield from resp.get("results", []) or []
+            if nxt is None:
+                break
+            resp = nxt.result()
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Helpers
 # ────────────────────────────────────────────────────────────────────────────────
+def _ascii_fold(s: str, _is_nfkd=unicodedata.is_normalized, _nfkd=unicodedata.normalize) -> str:
+    """Ékezetek levágása (NFKD + ASCII); tisztán ASCII bemenetnél (a legtöbb property-név) nincs teendő."""
+    if s.isascii():
+        return s
+    # Quick Check (C-ben): már NFKD alakú szövegnél a teljes normalizálás kimarad
+    if not _is_nfkd("NFKD", s):
+        s = _nfkd("NFKD", s)
+    return s.encode("ascii", "ignore").decode("ascii")
+
+_WS_RE = re.compile(r"\s+")
+
+@lru_cache(maxsize=1024)
 def _norm_key(s: str) -> str:
-    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
-    return re.sub(r"\s+", "", s or "").strip().lower()
+    return _WS_RE.sub("", _ascii_fold(s)).strip().lower()
+
+# belülről kifelé: a kód a legbelső, az áthúzás a legkülső jelölés
+_RICH_TEXT_MARKS = (("code", "`"), ("bold", "**"), ("italic", "*"), ("strikethrough", "~~"))
 
 def format_rich_text(rt_array: List[Dict]) -> str:
     out = []
     for r in rt_array or []:
         t = r.get("plain_text", "")
-        ann = (r.get("annotations") or {})
-        if ann.get("code"):      t = f"`{t}`"
-        if ann.get("bold"):      t = f"**{t}**"
-        if ann.get("italic"):    t = f"*{t}*"
-        if ann.get("strikethrough"): t = f"~~{t}~~"
-        out.append(t)
+        ann = r.get("annotations")
+        if not ann:
+            out.append(t)
+            continue
+        pre = suf = ""
+        for key, mark in _RICH_TEXT_MARKS:
+            if ann.get(key):
+                pre = mark + pre
+                suf = suf + mark
+        out.append(pre + t + suf if pre else t)
     return "".join(out)
 
-@st.cache_data(ttl=300)
-def collect_used_ids_and_names() -> Tuple[Dict[str, int], Dict[str, Set[str]]]:
-    ptype = get_property_type()
-    pages = query_all_pages()
-    used_by_id: Dict[str, int] = Counter()
-    names_seen: Dict[str, Set[str]] = defaultdict(set)
+# property típus → az oldalon kiválasztott opció-csomópontok listája
+_OPTION_EXTRACTORS = {
+    "select":       lambda p: [p.get("select") or {}],
+    "multi_select": lambda p: p.get("multi_select") or [],
+    "status":       lambda p: [p.get("status") or {}],
+}
 
-    for page in pages:
-        props = page.get("properties", {}) or {}
-        prop = props.get(PROPERTY_NAME, {}) or {}
-        if ptype == "select":
-            sl = prop.get("select") or {}
+@st.cache_resource(ttl=300)
+def _scan_database() -> Tuple[Dict[str, int], Dict[str, Set[str]], Dict[str, List[Dict]]]:
+    """Egyetlen teljes lekérdezés TTL-enként: opció-használat (id → db), látott nevek (id → nevek)
+    és az oldalak opciónév szerinti csoportjai. A tally és az export is ebből dolgozik.
+    A lekérdezést a Notion rendezi (resolve_sorts), így a csoportok listái a Notion sorrendjében
+    vannak – select/status opció-sorrend, formula, rollup is; Pythonban nem rendezünk újra.
+    cache_resource: nem másolódik hívásonként – a visszaadott listákat nem módosítjuk."""
+    extract = _OPTION_EXTRACTORS.get(get_property_type())
+    if extract is None:
+        return {}, {}, {}
+    sorts, _ = resolve_sorts(resolve_section_and_order_props()[1])
+    pname = PROPERTY_NAME
+    used: Counter = Counter()
+    names_seen: Dict[str, Set[str]] = defaultdict(set)
+    buckets: Dict[str, List[Dict]] = defaultdict(list)
+    for page in iter_all_pages(sorts):
+        for sl in extract((page.get("properties") or {}).get(pname) or {}):
             oid = sl.get("id")
+            name = (sl.get("name") or "").strip()
             if oid:
-                used_by_id[oid] += 1
-                name = (sl.get("name") or "").strip()
-                if name:
-                    names_seen[oid].add(name)
-        elif ptype == "multi_select":
-            arr = prop.get("multi_select") or []
-            for sl in arr:
-                oid = sl.get("id")
-                if oid:
-                    used_by_id[oid] += 1
-                    name = (sl.get("name") or "").strip()
-                    if name:
-                        names_seen[oid].add(name)
-        elif ptype == "status":
-            stv = prop.get("status") or {}
-            oid = stv.get("id")
-            if oid:
-                used_by_id[oid] += 1
-                name = (stv.get("name") or "").strip()
+                used[oid] += 1
                 if name:
                     names_seen[oid].add(name)
-    return dict(used_by_id), {k: set(v) for k, v in names_seen.items()}
+            if name:
+                buckets[name].append(page)
+    return dict(used), dict(names_seen), dict(buckets)
+
+@st.cache_data(ttl=300)
+def collect_used_ids_and_names() -> Tuple[Dict[str, int], Dict[str, Set[str]]]:
+    used, names_seen, _ = _scan_database()
+    return used, names_seen
+
+@dataclass
+class _DisplayEntry:
+    count: int = 0
+    canon: Set[str] = field(default_factory=set)
 
 @st.cache_data(ttl=300)
 def build_display_list() -> List[Tuple[str, int, Set[str]]]:
     used_by_id, names_seen = collect_used_ids_and_names()
     id2current = schema_id_to_current_name()
 
-    reverse_alias: Dict[str, Set[str]] = defaultdict(set)
-    for old, new in DISPLAY_RENAMES.items():
-        reverse_alias[new].add(old)
-
-    display_items: Dict[str, Dict[str, object]] = {}
+    display_items: Dict[str, _DisplayEntry] = {}
     for oid, cnt in used_by_id.items():
         current_candidates = names_seen.get(oid, set())
-        current_name = id2current.get(oid) or (sorted(current_candidates)[0] if current_candidates else f"(árva {oid[:6]}...)")
+        current_name = id2current.get(oid) or (min(current_candidates) if current_candidates else f"(árva {oid[:6]}...)")
         display_name = DISPLAY_RENAMES.get(current_name, current_name)
-        canon: Set[str] = set([current_name]) | current_candidates | reverse_alias.get(display_name, set())
-        entry = display_items.setdefault(display_name, {"count": 0, "canon": set()})
-        entry["count"] = int(entry["count"]) + cnt  # type: ignore
-        entry["canon"] = set(entry["canon"]) | canon  # type: ignore
-
-    items: List[Tuple[str, int, Set[str]]] = [
-        (disp, int(meta["count"]), set(meta["canon"]))  # type: ignore
-        for disp, meta in display_items.items()
-    ]
+        entry = display_items.get(display_name)
+        if entry is None:
+            entry = display_items[display_name] = _DisplayEntry()
+        entry.count += cnt
+        entry.canon.add(current_name)
+        entry.canon |= current_candidates
+        entry.canon |= REVERSE_ALIAS.get(display_name, set())
+
+    items: List[Tuple[str, int, Set[str]]] = [(disp, e.count, e.canon) for disp, e in display_items.items()]
     # UI-ban ABC szerint (nem kommunikáljuk a belső sorrendet)
     items.sort(key=lambda x: (x[0].lower()))
     return items
 
-def build_filter(ptype: str, name: str) -> Dict:
-    if ptype == "select":
-        return {"property": PROPERTY_NAME, "select": {"equals": name}}
-    if ptype == "multi_select":
-        return {"property": PROPERTY_NAME, "multi_select": {"contains": name}}
-    if ptype == "status":
-        return {"property": PROPERTY_NAME, "status": {"equals": name}}
-    raise RuntimeError(f"Nem támogatott property típus: {ptype}")
+_PREFIX_BY_TYPE: Dict[str, str] = {
+    "paragraph":          "",
+    "heading_1":          "# ",
+    "heading_2":          "## ",
+    "heading_3":          "### ",
+    "bulleted_list_item": "- ",
+    "numbered_list_item": "1. ",
+    "quote":              "> ",
+    "callout":            "> ",
+    "toggle":             "▸ ",
+}
+_TODO_CHECKED   = "- [x] "
+_TODO_UNCHECKED = "- [ ] "
+_RICH_TEXT_TYPES = frozenset(_PREFIX_BY_TYPE) | {"to_do"}
+
+def _block_line(block: Dict, indent: str) -> str:
+    btype = block.get("type")
+    data = block.get(btype, {}) or {}
+
+    if btype in _RICH_TEXT_TYPES:
+        txt = format_rich_text(data.get("rich_text", []))
+        if btype == "to_do":
+            prefix = _TODO_CHECKED if data.get("checked") else _TODO_UNCHECKED
+        else:
+            prefix = _PREFIX_BY_TYPE[btype]
+        return indent + prefix + txt
+
+    if btype == "code":
+        lang = (data.get("language") or "").strip()
+        code = data.get("rich_text", [])
+        content = "".join([t.get("plain_text", "") for t in code])
+        return f"```{lang}\n{content}\n```"
+
+    if btype == "divider":
+        return "---"
 
-def blocks_to_md(block_id: str, depth: int = 0) -> str:
+    return ""
+
+def _list_children(block_id: str) -> List[Dict]:
     client = get_client()
-    lines: List[str] = []
+    results: List[Dict] = []
     cursor = None
-    indent = "  " * depth
-
     while True:
         resp = with_backoff(client.blocks.children.list, block_id=block_id, start_cursor=cursor)
-        for block in resp.get("results", []) or []:
-            btype = block.get("type")
-            data = block.get(btype, {}) or {}
-            line = ""
-
-            if btype in (
-                "paragraph", "heading_1", "heading_2", "heading_3",
-                "bulleted_list_item", "numbered_list_item",
-                "quote", "to_do", "callout", "toggle"
-            ):
-                txt = format_rich_text(data.get("rich_text", []))
-                prefix = ""
-                if   btype == "heading_1":          prefix = "# "
-                elif btype == "heading_2":          prefix = "## "
-                elif btype == "heading_3":          prefix = "### "
-                elif btype == "bulleted_list_item": prefix = "- "
-                elif btype == "numbered_list_item": prefix = "1. "
-                elif btype == "quote":              prefix = "> "
-                elif btype == "to_do":
-                    checked = "x" if data.get("checked") else " "
-                    prefix = f"- [{checked}] "
-                elif btype == "callout":            prefix = "> "
-                elif btype == "toggle":             prefix = "▸ "
-
-                if prefix:
-                    line = indent + prefix + txt
-                else:
-                    line = indent + txt
-
-            elif btype == "code":
-                lang = (data.get("language") or "").strip()
-                code = data.get("rich_text", [])
-                content = "".join([t.get("plain_text", "") for t in code])
-                line = f"```{lang}\n{content}\n```"
-
-            elif btype == "divider":
-                line = "---"
-
-            if line:
-                lines.append(line)
-
-            if block.get("has_children"):
-                lines.append(blocks_to_md(block["id"], depth=depth + 1))
-
+        results.extend(resp.get("results", []) or [])
         if not resp.get("has_more"):
             break
         cursor = resp.get("next_cursor")
+    return results
 
-    return "\n".join(lines).strip()
+def _strip_segment(lines: List[str], start: int) -> None:
+    """Helyben ugyanaz, mint a "\n".join(lines[start:]).strip() egyetlen elemként (üres → "")."""
+    while len(lines) > start and not lines[-1].strip():
+        lines.pop()
+    i = start
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+    del lines[start:i]
+    if len(lines) > start:
+        lines[start] = lines[start].lstrip()
+        lines[-1] = lines[-1].rstrip()
+    else:
+        lines.append("")
+
+def _fetch_block_tree(root_id: str, tree: Optional[Dict[str, List[Dict]]] = None) -> Dict[str, List[Dict]]:
+    """A blokkfa letöltése szintenként (szülő id → gyerekek); egy szint gyerek-listái párhuzamosan jönnek.
+    A `tree`-ben már meglévő részfákat nem kérjük le újra, így egy szűkített letöltés később kiegészíthető."""
+    tree = {} if tree is None else tree
+    if root_id not in tree:
+        tree[root_id] = _list_children(root_id)
+    level = [b["id"] for b in tree[root_id] if b.get("has_children") and b["id"] not in tree]
+    if not level:
+        return tree
+    with _thread_pool(BLOCK_WORKERS) as ex:
+        while level:
+            nxt: List[str] = []
+            for bid, children in zip(level, ex.map(_list_children, level)):
+                tree[bid] = children
+                nxt.extend(c["id"] for c in children if c.get("has_children") and c["id"] not in tree)
+            level = nxt
+    return tree
+
+def _render_block_tree(tree: Dict[str, List[Dict]], root_id: str, depth: int = 0) -> str:
+    # iteratív DFS egyetlen kimeneti listába; a gyerek-szegmenseket úgy zárjuk le,
+    # ahogy a korábbi rekurzív változat (join + strip szintenként). Le nem töltött részfa → nincs gyerek.
+    lines: List[str] = []
+    stack = [(iter(tree[root_id]), depth, 0)]
+    while stack:
+        children, d, seg_start = stack[-1]
+        block = next(children, None)
+        if block is None:
+            stack.pop()
+            if stack:
+                _strip_segment(lines, seg_start)
+            continue
 
-def _split_h2_sections(md: str) -> Dict[str, List[str]]:
-    sections: Dict[str, List[str]] = {}
-    current = None
-    lines = md.splitlines()
-    for ln in lines:
-        if ln.startswith("## "):
-            current = ln[3:].strip()
-            sections[current] = []
-        else:
-            if current is not None:
-                sections[current].append(ln)
-    return sections
+        line = _block_line(block, "  " * d)
+        if line:
+            lines.append(line)
 
-def _join(lines: List[str]) -> str:
-    return "\n".join(lines).strip()
+        if block.get("has_children"):
+            stack.append((iter(tree.get(block["id"], ())), d + 1, len(lines)))
 
-def _normalize(s: str) -> str:
-    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
-    s = s.strip().lower()
-    for ch in (" ", "_", "-", ".", ":"):
-        s = s.replace(ch, "")
-    return s
+    return "\n".join(lines).strip()
 
 SECTION_TARGETS = ["szakasz", "szekcio", "section", "modul", "fejezet", "rész", "resz"]
 ORDER_TARGETS   = ["sorszám", "sorszam", "sorrend", "order", "index", "pozicio", "pozíció", "rank"]
@@ -362,183 +493,348 @@ def resolve_section_and_order_props() -> Tuple[str, str]:
 
     return sec_key, ord_key
 
-def extract_title(page: Dict) -> str:
-    props = page.get("properties", {}) or {}
-    title_key = None
+@st.cache_data(ttl=300)
+def resolve_title_prop_name() -> str:
+    db = get_database_schema()
+    props: Dict[str, Dict] = db.get("properties", {}) or {}
     for k, v in props.items():
         if v.get("type") == "title":
-            title_key = k; break
-    if not title_key:
-        for k in ("Lecke címe", "Lecke cime", "Cím", "Cim", "Name", "Név"):
-            if k in props and props[k].get("type") in ("title", "rich_text"):
-                title_key = k; break
+            return k
+    for k in ("Lecke címe", "Lecke cime", "Cím", "Cim", "Name", "Név"):
+        if k in props and props[k].get("type") in ("title", "rich_text"):
+            return k
+    return ""
+
+def extract_title(page: Dict, title_key: str) -> str:
     if not title_key:
         return "(cím nélkül)"
-    title_arr = props[title_key].get("title") or props[title_key].get("rich_text") or []
+    p = (page.get("properties", {}) or {}).get(title_key, {}) or {}
+    title_arr = p.get("title") or p.get("rich_text") or []
     title = "".join([t.get("plain_text", "") for t in title_arr]).strip()
     return title or "(cím nélkül)"
 
+def _fmt_date(p: Dict) -> str:
+    d = p.get("date") or {}
+    return (d.get("start") or "") + ((" – " + d.get("end")) if d.get("end") else "")
+
+def _fmt_people(p: Dict) -> str:
+    names = []
+    for person in p.get("people") or []:
+        name = (person.get("name") or "").strip()
+        if not name: name = (person.get("person", {}) or {}).get("email", "") or ""
+        if name: names.append(name)
+    return ", ".join(names)
+
+# property típus → CSV-cella formázó
+_PROPERTY_FORMATTERS: Dict[str, Callable[[Dict], str]] = {
+    "number":       lambda p: "" if p.get("number") is None else str(p.get("number")),
+    "select":       lambda p: ((p.get("select") or {}).get("name") or "").strip(),
+    "multi_select": lambda p: ", ".join([(x.get("name") or "").strip() for x in p.get("multi_select") or [] if x.get("name")]),
+    "status":       lambda p: ((p.get("status") or {}).get("name") or "").strip(),
+    "rich_text":    lambda p: "".join([t.get("plain_text", "") for t in p.get("rich_text") or []]).strip(),
+    "date":         _fmt_date,
+    "url":          lambda p: p.get("url") or "",
+    "email":        lambda p: p.get("email") or "",
+    "people":       _fmt_people,
+}
+
 def format_property_for_csv(page: Dict, prop_name: str) -> str:
     props = page.get("properties", {}) or {}
     p = props.get(prop_name, {}) or {}
-    ptype = p.get("type")
-    try:
-        if ptype == "number":
-            v = p.get("number"); return "" if v is None else str(v)
-        if ptype == "select":
-            s = p.get("select") or {}; return (s.get("name") or "").strip()
-        if ptype == "multi_select":
-            arr = p.get("multi_select") or []; return ", ".join([(x.get("name") or "").strip() for x in arr if x.get("name")])
-        if ptype == "status":
-            s = p.get("status") or {}; return (s.get("name") or "").strip()
-        if ptype == "rich_text":
-            arr = p.get("rich_text") or []; return "".join([t.get("plain_text", "") for t in arr]).strip()
-        if ptype == "date":
-            d = p.get("date") or {}; return (d.get("start") or "") + ((" – " + d.get("end")) if d.get("end") else "")
-        if ptype == "url": return p.get("url") or ""
-        if ptype == "email": return p.get("email") or ""
-        if ptype == "people":
-            arr = p.get("people") or []; names = []
-            for person in arr:
-                name = (person.get("name") or "").strip()
-                if not name: name = (person.get("person", {}) or {}).get("email", "") or ""
-                if name: names.append(name)
-            return ", ".join(names)
+    fmt = _PROPERTY_FORMATTERS.get(p.get("type"))
+    if fmt is None:
         return ""
+    try:
+        return fmt(p)
     except Exception:
         return ""
 
+@st.cache_data(ttl=300, show_spinner=False)
 def resolve_sorts(order_prop: Optional[str]) -> Tuple[List[Dict], str]:
     if order_prop:
         return [{"property": order_prop, "direction": "ascending"}], f"Sorszám (`{order_prop}`) szerint növekvő"
-    db = get_database_schema()
-    title_key = None
-    for k, v in (db.get("properties", {}) or {}).items():
-        if v.get("type") == "title":
-            title_key = k; break
-    if not title_key: title_key = "Name"
+    title_key = resolve_title_prop_name() or "Name"
     return [{"property": title_key, "direction": "ascending"}], f"Cím (`{title_key}`) szerint ABC növekvő"
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Markdown tisztítás + kivágás
 # ────────────────────────────────────────────────────────────────────────────────
+# Egyetlen menetes tisztító minta (a korábbi 5× re.sub + replace helyett):
+#   nl/h   – címsor (előtte üres sor, "##Miért" -> "## Miért")
+#   nl/q   – idézet (előtte üres sor, "> - " -> "- ")
+#   run    – 3+ sortörés -> 1 üres sor
+#   stars  – felesleges "****"
+_CLEAN_RE = re.compile(
+    r"(?P<nl>\n+)?(?:^(?P<h>#+)(?=(?P<hn>[^#]))|^>(?=\s)(?P<qd>\s-\s)?)"
+    r"|(?P<run>\n{3,})"
+    r"|(?P<stars>\*\*\*\*)",
+    re.M,
+)
+
+def _clean_dispatch(m: "re.Match[str]") -> str:
+    if m.group("stars"):
+        return ""
+    if m.group("run"):
+        return "\n\n"
+    prefix = "\n\n" if m.group("nl") else ""
+    h = m.group("h")
+    if h:
+        return prefix + h + ("" if m.group("hn").isspace() else " ")
+    if m.group("qd"):
+        return prefix + "- "
+    return prefix + ">"
+
 def clean_markdown(md: str) -> str:
     """Kíméletes tisztítás: címsorok, idézetek, whitespace normalizálás, kódblokkok érintetlenek."""
     if not md:
         return ""
-    md = re.sub(r"^(#+)([^\s#])", r"\1 \2", md, flags=re.M)     # ##Miért -> ## Miért
-    md = re.sub(r"(\n#+\s)", r"\n\n\1", md)                     # heading előtt üres sor
-    md = re.sub(r"(\n>\s)",  r"\n\n\1", md)                     # idézet előtt üres sor
-    md = re.sub(r"\n{3,}", "\n\n", md)                          # 3+ üres sor -> 1
-    md = re.sub(r"^>\s-\s", "- ", md, flags=re.M)               # > - minta kisimítása
-    md = md.replace("****", "")                                  # felesleges formázás
-    return md.strip()
-
-def _split_h2_sections(md: str) -> Dict[str, List[str]]:
+    return _CLEAN_RE.sub(_clean_dispatch, md).strip()
+
+def _split_h2_sections(md: str, keep: Optional[frozenset] = None) -> Dict[str, List[str]]:
+    """H2 cím → a szakasz sorai. `keep`: csak azok a szakaszok, amelyek normalizált címe benne van
+    (a többi sorait nem gyűjtjük)."""
     sections: Dict[str, List[str]] = {}
-    current = None
-    lines = md.splitlines()
-    for ln in lines:
+    current: Optional[List[str]] = None
+    if "## " not in md:
+        return sections
+    for ln in md.splitlines():
         if ln.startswith("## "):
-            current = ln[3:].strip()
-            sections[current] = []
-        else:
-            if current is not None:
-                sections[current].append(ln)
+            title = ln[3:].strip()
+            if keep is None or _normalize(title) in keep:
+                current = sections[title] = []
+            else:
+                current = None
+        elif current is not None:
+            current.append(ln)
     return sections
 
 def _join(lines: List[str]) -> str:
     return "\n".join(lines).strip()
 
+# " _-.:" törlése egyetlen translate hívással (5× replace helyett)
+_STRIP_TABLE = str.maketrans("", "", " _-.:")
+
+@lru_cache(maxsize=1024)
 def _normalize(s: str) -> str:
-    s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
-    s = s.strip().lower()
-    for ch in (" ", "_", "-", ".", ":"):
-        s = s.replace(ch, "")
-    return s
+    return _ascii_fold(s).strip().lower().translate(_STRIP_TABLE)
+
+_VIDEO_TARGETS = frozenset(_normalize(v) for v in (
+    "Videó szöveg", "Video szoveg", "Video szöveg", "Videó szoveg", "Videó", "Video",
+))
+_LESSON_TARGETS = frozenset(_normalize(v) for v in (
+    "Lecke szöveg", "Lecke szoveg", "Lecke", "Lecke anyag",
+))
+
+_CONTENT_TARGETS = _VIDEO_TARGETS | _LESSON_TARGETS
 
 def select_video_or_lesson_with_type(md: str) -> Tuple[str, Optional[str]]:
     """Visszaadja a kivágott szöveget és a típust: 'video_szoveg' / 'lecke_szoveg' / None."""
-    sections = _split_h2_sections(md)
+    # szekciócímek normalizálása oldalanként egyszer
+    sections = [(_normalize(k), lines) for k, lines in _split_h2_sections(md, _CONTENT_TARGETS).items()]
 
-    def pick(variants: List[str]) -> Optional[str]:
-        targets = set(_normalize(v) for v in variants)
-        for k in sections.keys():
-            if _normalize(k) in targets:
-                body = _join(sections[k]).strip()
+    def pick(targets: frozenset) -> Optional[str]:
+        for key, lines in sections:
+            if key in targets:
+                body = _join(lines)
                 if body:
                     return body
         return None
 
-    video = pick(["Videó szöveg", "Video szoveg", "Video szöveg", "Videó szoveg", "Videó", "Video"])
+    video = pick(_VIDEO_TARGETS)
     if video:
         return video, "video_szoveg"
-    lesson = pick(["Lecke szöveg", "Lecke szoveg", "Lecke", "Lecke anyag"])
+    lesson = pick(_LESSON_TARGETS)
     if lesson:
         return lesson, "lecke_szoveg"
     return "", None
 
-def fix_numbered_lists(md: str) -> str:
-    lines = md.splitlines()
-    out: List[str] = []
-    in_code = False
-    fence_re = re.compile(r"^\s*```")
-    num_re = re.compile(r"^(\s*)(\d+)\.\s+(.*)$")
-    counter_for_indent: Dict[int, int] = {}
-    active_list_indent: Optional[int] = None
 
+def _content_root_ids(root: List[Dict]) -> Optional[Set[str]]:
+    """A gyökérszintű blokkok közül azok, amelyek videó/lecke H2 szakaszba esnek (a címsort is beleértve);
+    None, ha a gyökérszinten nincs ilyen H2."""
+    keep: Set[str] = set()
+    inside = found = False
+    for b in root:
+        if b.get("type") == "heading_2":
+            title = _block_line(b, "").split("\n", 1)[0][3:].strip()
+            inside = _normalize(title) in _CONTENT_TARGETS
+            found = found or inside
+        if inside:
+            keep.add(b["id"])
+    return keep if found else None
+
+def page_content_md(page_id: str) -> Tuple[str, Optional[str]]:
+    """Az oldal kiválasztott szakasza (markdown) és típusa. Ha a gyökérszinten van videó/lecke H2, csak ezeket
+    a szakaszokat (és alblokkjaikat) töltjük le és rendereljük, a többi úgyis kiesik; ha így nem jön ki
+    tartalom, a teljes fát is letöltjük (a már meglévő részfákat újrahasznosítva)."""
+    root = _list_children(page_id)
+    keep = _content_root_ids(root)
+    tree: Dict[str, List[Dict]] = {}
+    if keep is not None:
+        tree[page_id] = [b for b in root if b["id"] in keep]
+        md = _render_block_tree(_fetch_block_tree(page_id, tree), page_id)
+        chosen, section_type = select_video_or_lesson_with_type(md)
+        if chosen:
+            return chosen, section_type
+    tree[page_id] = root
+    md = _render_block_tree(_fetch_block_tree(page_id, tree), page_id)
+    return select_video_or_lesson_with_type(md)
+
+_FENCE_RE = re.compile(r"^\s*```")
+_NUM_RE = re.compile(r"^(\s*)(\d+)\.\s+(.*)$")
+# gyorsellenőrzés: minden _NUM_RE-re illeszkedő sorban van "számjegy + pont + szóköz"
+_NUM_HINT_RE = re.compile(r"\d\.\s")
+
+def _renumber_lines(lines):
+    """Soronként újraszámozza a számozott listákat (kódblokkon kívül). A számláló csak az
+    egymást közvetlenül követő, azonos behúzású tételek között öröklődik, így elég egy int."""
+    in_code = False
+    active_indent: Optional[int] = None
+    n = 0
     for line in lines:
-        if fence_re.match(line):
-            in_code = not in_code; out.append(line); continue
-        if in_code: out.append(line); continue
+        if "```" in line and _FENCE_RE.match(line):
+            in_code = not in_code
+            yield line
+            continue
+        if in_code:
+            yield line
+            continue
 
-        m = num_re.match(line)
+        m = _NUM_RE.match(line)
         if m:
-            indent_str = m.group(1); indent_len = len(indent_str); content = m.group(3)
-            if active_list_indent is None or indent_len != active_list_indent:
-                active_list_indent = indent_len
-                for k in list(counter_for_indent.keys()):
-                    if k >= indent_len: del counter_for_indent[k]
-                counter_for_indent[indent_len] = 1
+            indent_str = m.group(1)
+            if len(indent_str) != active_indent:
+                active_indent = len(indent_str)
+                n = 1
             else:
-                counter_for_indent[indent_len] = counter_for_indent.get(indent_len, 0) + 1
-            n = counter_for_indent[indent_len]
-            out.append(f"{indent_str}{n}. {content}")
+                n += 1
+            yield f"{indent_str}{n}. {m.group(3)}"
         else:
-            active_list_indent = None; out.append(line)
+            active_indent = None
+            yield line
 
-    return "\n".join(out).strip()
+def fix_numbered_lists(md: str) -> str:
+    lines = md.splitlines()
+    if not _NUM_HINT_RE.search(md):
+        # nincs számozott sor (pl. videó-átirat): a soronkénti bejárás kimarad
+        return "\n".join(lines).strip()
+    return "\n".join(_renumber_lines(lines)).strip()
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Közös építők – oldal → sor
 # ────────────────────────────────────────────────────────────────────────────────
+def all_pages_by_option() -> Dict[str, List[Dict]]:
+    """Opciónév → oldalak, a tally-vel közös teljes lekérdezésből (csoportonkénti szűrt query-k helyett)."""
+    return _scan_database()[2]
+
+@dataclass(frozen=True)
+class ExportCtx:
+    """Egy exportfutás alatt változatlan séma-adatok – egyszer oldjuk fel, és végigadjuk a soroknak."""
+    section_prop: str
+    order_prop: str
+    title_key: str
+    use_page_cache: bool = False
+
+    @classmethod
+    def build(cls, use_page_cache: bool = False) -> "ExportCtx":
+        # a kapcsolót a hívó adja át: cache_data-függvényen belül a session_state nem része a kulcsnak
+        section_prop, order_prop = resolve_section_and_order_props()
+        return cls(section_prop, order_prop, resolve_title_prop_name(), use_page_cache)
+
 def _pages_for_group(display_name: str, canonical_names: Set[str]) -> List[Dict]:
-    ptype = get_property_type()
-    section_prop, order_prop = resolve_section_and_order_props()
-    sorts, _ = resolve_sorts(order_prop)
+    """A csoport oldalai a közös lekérdezés sorrendjében (resolve_sorts, Notion oldalon rendezve)."""
+    buckets = all_pages_by_option()
 
     pages: List[Dict] = []
-    for nm in sorted(canonical_names, key=lambda s: (0 if s == display_name else 1, s)):
-        try:
-            subset = query_filtered_pages(filter_=build_filter(ptype, nm), sorts=sorts)
-        except APIResponseError:
-            subset = []
+    rest = sorted(n for n in canonical_names if n != display_name)
+    for nm in ([display_name] + rest if display_name in canonical_names else rest):
+        subset = buckets.get(nm)
         if subset:
             pages = subset
             break
     return pages
 
-def _row_from_page(page: Dict) -> Tuple[Dict[str, str], Optional[str]]:
-    section_prop, order_prop = resolve_section_and_order_props()
-    title = extract_title(page)
-    section_val = format_property_for_csv(page, section_prop) if section_prop else ""
-    order_val   = format_property_for_csv(page, order_prop) if order_prop else ""
+def prefetch_pages_by_group(groups: List[Tuple[str, int, Set[str]]]) -> Dict[str, List[Dict]]:
+    """Az összes csoport oldallistája előre, egyetlen teljes lekérdezésből (a fő szálon)."""
+    return {name: _pages_for_group(name, canon) for name, _, canon in groups}
+
+def _prefetched_pages(slot: str, run_id: str, groups: List[Tuple[str, int, Set[str]]]) -> Dict[str, List[Dict]]:
+    """Futásonként egyszer; a session_state-ben tartva a folytatás sem kérdez le újra (akkor sem, ha a cache lejárt).
+    Motoronként (slot) csak az aktuális futás listái maradnak meg: új futás felülírja a régit."""
+    store = st.session_state.setdefault("prefetched_pages", {})
+    held = store.get(slot)
+    if held is None or held[0] != run_id:
+        held = store[slot] = (run_id, prefetch_pages_by_group(groups))
+    return held[1]
+
+def _drop_prefetched_pages(slot: str, run_id: str):
+    """Kész futás után az oldallisták már nem kellenek."""
+    store = st.session_state.get("prefetched_pages") or {}
+    if slot in store and store[slot][0] == run_id:
+        del store[slot]
+
+class PageCache:
+    """Lemezes (SQLite) cache oldalanként: (page_id, last_edited_time, PAGE_CACHE_VERSION) → a kiválasztott,
+    utófeldolgozott tartalom. Változatlan oldalnál se blokk-letöltés, se átalakítás nem kell."""
+    def __init__(self, path: str):
+        _ensure_dir(os.path.dirname(path))
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            cols = {r[1] for r in self.conn.execute("PRAGMA table_info(pages)")}
+            if cols and "version" not in cols:
+                # régi séma (md oszlop, verzió nélkül) – csak cache, eldobjuk
+                self.conn.execute("DROP TABLE pages")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "page_id TEXT PRIMARY KEY, last_edited TEXT NOT NULL, version INTEGER NOT NULL, content TEXT, section_type TEXT)"
+            )
+            self.conn.commit()
+
+    def get(self, page_id: str, last_edited: str) -> Optional[Tuple[str, Optional[str]]]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content, section_type FROM pages WHERE page_id = ? AND last_edited = ? AND version = ?",
+                (page_id, last_edited, PAGE_CACHE_VERSION),
+            ).fetchone()
+        return (row[0] or "", row[1]) if row else None
+
+    def put(self, page_id: str, last_edited: str, content: str, section_type: Optional[str]):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (page_id, last_edited, version, content, section_type) VALUES (?, ?, ?, ?, ?)",
+                (page_id, last_edited, PAGE_CACHE_VERSION, content, section_type),
+            )
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM pages")
+            self.conn.commit()
 
-    md = blocks_to_md(page["id"])
-    chosen, section_type = select_video_or_lesson_with_type(md)
-    if chosen:
-        chosen = fix_numbered_lists(chosen)
-        chosen = clean_markdown(chosen)
+@st.cache_resource
+def get_page_cache() -> PageCache:
+    return PageCache(PAGE_CACHE_PATH)
+
+def _row_from_page(page: Dict, ctx: ExportCtx) -> Tuple[Dict[str, str], Optional[str]]:
+    title = extract_title(page, ctx.title_key)
+    section_val = format_property_for_csv(page, ctx.section_prop) if ctx.section_prop else ""
+    order_val   = format_property_for_csv(page, ctx.order_prop) if ctx.order_prop else ""
+
+    edited = page.get("last_edited_time") or ""
+    cache = get_page_cache() if ctx.use_page_cache and edited else None
+    hit = cache.get(page["id"], edited) if cache else None
+    if hit:
+        chosen, section_type = hit
+    else:
+        chosen, section_type = page_content_md(page["id"])
+        if chosen:
+            chosen = fix_numbered_lists(chosen)
+            chosen = clean_markdown(chosen)
+        if cache:
+            cache.put(page["id"], edited, chosen or "", section_type)
 
     base = {
         "oldal_cime": title,
@@ -548,13 +844,21 @@ def _row_from_page(page: Dict) -> Tuple[Dict[str, str], Optional[str]]:
     }
     return base, section_type
 
+def _rows_from_pages(pages: List[Dict], ctx: ExportCtx) -> List[Tuple[Dict[str, str], Optional[str]]]:
+    """Oldalak → sorok; a blokk-letöltés oldalanként párhuzamos, az eredmény sorrendje az oldalaké."""
+    if len(pages) <= 1:
+        return [_row_from_page(pg, ctx) for pg in pages]
+    with _thread_pool(min(PAGE_WORKERS, len(pages))) as ex:
+        return list(ex.map(lambda pg: _row_from_page(pg, ctx), pages))
+
 # ────────────────────────────────────────────────────────────────────────────────
 # Hosszú cella darabolás (CSV-hez)
 # ────────────────────────────────────────────────────────────────────────────────
-def _split_content_for_csv(text: str, max_len: int) -> Dict[str, str]:
+def _split_content_parts(text: str, max_len: int) -> List[str]:
+    """A tartalom darabjai sorrendben: [tartalom, tartalom_cont_1, ...]."""
     text = text or ""
     if len(text) <= max_len:
-        return {"tartalom": text}
+        return [text]
 
     parts: List[str] = []
     start = 0
@@ -569,60 +873,50 @@ def _split_content_for_csv(text: str, max_len: int) -> Dict[str, str]:
         if part:
             parts.append(part)
         start = end
-
-    out: Dict[str, str] = {}
-    for i, p in enumerate(parts):
-        if i == 0:
-            out["tartalom"] = p
-        else:
-            out[f"tartalom_cont_{i}"] = p
-    return out
-
-def _max_cont_cols(rows: List[Dict[str, str]]) -> int:
-    mx = 0
-    for r in rows:
-        for k in r.keys():
-            m = re.match(r"tartalom_cont_(\d+)$", k)
-            if m:
-                mx = max(mx, int(m.group(1)))
-    return mx
+    return parts
+
+def _cont_fieldnames(max_extra: int) -> List[str]:
+    return [f"tartalom_cont_{i}" for i in range(1, max_extra + 1)]
+
+def _write_csv_rows(out: io.BufferedIOBase, base_fields: List[str], rows: List[List[str]], max_extra: int) -> None:
+    """Pozicionális sorok → CSV közvetlenül bináris kimenetbe (UTF-8 kódolás menet közben, nincs teljes str másolat);
+    a rövidebb sorokat csak íráskor egészítjük ki üres cellákkal."""
+    width = len(base_fields) + max_extra
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(base_fields + _cont_fieldnames(max_extra))
+    writer.writerows(r if len(r) >= width else r + [""] * (width - len(r)) for r in rows)
+    text.flush()
+    text.detach()
+
+def _rows_to_csv_bytes(base_fields: List[str], rows: List[List[str]], max_extra: int) -> bytes:
+    buf = io.BytesIO()
+    _write_csv_rows(buf, base_fields, rows, max_extra)
+    return buf.getvalue()
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Eredeti per-kurzus export (MEGMARAD)
 # ────────────────────────────────────────────────────────────────────────────────
-def export_one(display_name: str, canonical_names: Set[str]) -> bytes:
-    pages = _pages_for_group(display_name, canonical_names)
-
-    if not pages:
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=CSV_FIELDNAMES)
-        writer.writeheader()
-        return output.getvalue().encode("utf-8")
-
-    rows_base: List[Dict[str, str]] = []
-    for pg in pages:
-        base, _stype = _row_from_page(pg)
-        rows_base.append(base)
-
-    split_rows: List[Dict[str, str]] = []
-    for r in rows_base:
-        chunks = _split_content_for_csv(r.get("tartalom", ""), MAX_CONTENT_CHARS)
-        out = dict(r)
-        out.pop("tartalom", None)
-        out.update(chunks)
-        split_rows.append(out)
-
-    max_extra = _max_cont_cols(split_rows)
-    fieldnames = ["oldal_cime", "szakasz", "sorszam", "tartalom"] + [f"tartalom_cont_{i}" for i in range(1, max_extra + 1)]
-
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    for r in split_rows:
-        for i in range(1, max_extra + 1):
-            r.setdefault(f"tartalom_cont_{i}", "")
-        writer.writerow(r)
-    return output.getvalue().encode("utf-8")
+def export_one(display_name: str, canonical_names: Set[str], ctx: Optional[ExportCtx] = None,
+               pages: Optional[List[Dict]] = None) -> bytes:
+    ctx = ctx or ExportCtx.build()
+    if pages is None:
+        pages = _pages_for_group(display_name, canonical_names)
+
+    # egy menetben: sorok pozicionálisan, max_extra menet közben
+    rows: List[List[str]] = []
+    max_extra = 0
+    for base, _stype in _rows_from_pages(pages, ctx):
+        chunks = _split_content_parts(base["tartalom"], MAX_CONTENT_CHARS)
+        max_extra = max(max_extra, len(chunks) - 1)
+        rows.append([base["oldal_cime"], base["szakasz"], base["sorszam"], *chunks])
+    return _rows_to_csv_bytes(CSV_FIELDNAMES, rows, max_extra)
+
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def export_one_cached(display_name: str, canonical_names: frozenset, schema_token: str,
+                      use_page_cache: bool = False) -> bytes:
+    """Egyenkénti letöltéshez: ugyanazon csoport újraexportja (azonos sémával és cache-kapcsolóval) nem kérdez újra."""
+    return export_one(display_name, set(canonical_names), ExportCtx.build(use_page_cache))
 
 # ────────────────────────────────────────────────────────────────────────────────
 # ÚJ: Összes – egy munkalap (CSV) robusztus motorral
@@ -642,6 +936,39 @@ def _append_log(run_id: str, msg: str):
     except Exception:
         pass
 
+def _json_default(o):
+    # futás közben a completed/failed élő set; a fájlba rendezett listaként kerül
+    if isinstance(o, (set, frozenset)):
+        return sorted(o)
+    if isinstance(o, deque):
+        return list(o)
+    raise TypeError(f"Nem szerializálható: {type(o).__name__}")
+
+def _json_dump_bytes(state: dict) -> bytes:
+    return orjson.dumps(state, option=orjson.OPT_NON_STR_KEYS, default=_json_default)
+
+def _json_load_file(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    return orjson.loads(data)
+
+# path → utoljára kiírt JSON; változatlan állapotot nem írunk újra
+_LAST_JSON_WRITTEN: Dict[str, bytes] = {}
+
+def _write_json_atomic(path: str, state: dict) -> bool:
+    """Ideiglenes fájlba ír, majd os.replace-szel cseréli; megszakadt írás nem hagy csonka checkpointot.
+    False, ha a tartalom nem változott (nincs írás)."""
+    payload = _json_dump_bytes(state)
+    if _LAST_JSON_WRITTEN.get(path) == payload and os.path.exists(path):
+        return False
+    _ensure_dir(os.path.dirname(path))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+    _LAST_JSON_WRITTEN[path] = payload
+    return True
+
 # Unified specific paths
 def _unified_paths(run_id: str) -> Dict[str, str]:
     rd = _run_dir(run_id)
@@ -652,85 +979,77 @@ def _unified_paths(run_id: str) -> Dict[str, str]:
     }
 
 def _save_unified_cp(run_id: str, state: dict):
-    _ensure_dir(_run_dir(run_id))
-    with open(_unified_paths(run_id)["checkpoint"], "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    _write_json_atomic(_unified_paths(run_id)["checkpoint"], state)
 
-def _load_unified_cp(run_id: str) -> Optional[dict]:
+def _load_unified_cp(run_id: str, allow_stale: bool = False) -> Optional[dict]:
     try:
-        with open(_unified_paths(run_id)["checkpoint"], "r", encoding="utf-8") as f:
-            return json.load(f)
+        cp = _json_load_file(_unified_paths(run_id)["checkpoint"])
     except Exception:
         return None
+    return None if cp and not allow_stale and _checkpoint_stale(cp) else cp
 
-def _append_unified_rows(run_id: str, rows: List[Dict[str, str]]) -> int:
-    """Sorokat írunk NDJSON-ba (soronként 1 JSON). Visszatér: írt sorok száma."""
+def _append_unified_rows(run_id: str, rows: List[List[str]]) -> int:
+    """Sorokat írunk NDJSON-ba (soronként 1 JSON). Visszatér: írt sorok száma.
+    A mappát a hívó (unified_export_engine) egyszer, előre hozza létre."""
     p = _unified_paths(run_id)["rows_ndjson"]
-    _ensure_dir(os.path.dirname(p))
     with open(p, "a", encoding="utf-8") as f:
-        for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in rows)
     return len(rows)
 
-def _finalize_unified_csv(run_id: str) -> bytes:
-    """NDJSON → CSV (fejléc dinamikusan: tartalom_cont_X max alapján)"""
+CSV_WRITE_BUFFER = 1 << 20
+
+def _finalize_unified_csv(run_id: str) -> str:
+    """NDJSON → CSV fájl (fejléc dinamikusan: tartalom_cont_X max alapján); visszatér: a CSV útvonala.
+    A CSV közvetlenül (tmp fájlba) íródik, memóriában nem áll össze bájtként; a kész fájlt
+    os.replace teszi a helyére, így félbeszakadt írás után nem marad csonka csv_out."""
     paths = _unified_paths(run_id)
     nd = paths["rows_ndjson"]
     if not os.path.exists(nd):
-        return b""
+        open(paths["csv_out"], "wb").close()
+        return paths["csv_out"]
 
     max_extra = 0
-    rows: List[Dict[str, str]] = []
+    rows: List[List[str]] = []
     with open(nd, "r", encoding="utf-8") as f:
         for line in f:
             if not line.strip(): continue
-            obj = json.loads(line)
-            rows.append(obj)
-            for k in obj.keys():
-                m = re.match(r"tartalom_cont_(\d+)$", k)
-                if m:
-                    max_extra = max(max_extra, int(m.group(1)))
-
-    fieldnames = ["course", "oldal_cime", "szakasz", "sorszam", "section_type", "tartalom"] + [f"tartalom_cont_{i}" for i in range(1, max_extra + 1)]
-    out = io.StringIO()
-    w = csv.DictWriter(out, fieldnames=fieldnames)
-    w.writeheader()
-    for r in rows:
-        for i in range(1, max_extra + 1):
-            r.setdefault(f"tartalom_cont_{i}", "")
-        w.writerow(r)
-    data = out.getvalue().encode("utf-8")
-
-    # írjuk fájlba is (stabilitás/újraleszedés)
-    with open(paths["csv_out"], "wb") as f:
-        f.write(data)
-    return data
-
-def _retry_build_rows(display_name: str, canon: Set[str], max_tries: int = 3) -> Tuple[List[Dict[str, str]], int]:
-    """Felépíti a unified sorokat egy kurzushoz. Visszaad: sorok, újrapróbálások száma."""
+            row = json.loads(line)
+            if isinstance(row, dict):
+                # korábbi futás NDJSON-ja (kulcsos sorok) – folytatáskor is olvasható marad
+                obj, row = row, [row.get(k, "") for k in UNIFIED_FIELDNAMES]
+                i = 1
+                while f"tartalom_cont_{i}" in obj:
+                    row.append(obj[f"tartalom_cont_{i}"])
+                    i += 1
+            max_extra = max(max_extra, len(row) - len(UNIFIED_FIELDNAMES))
+            rows.append(row)
+
+    # a csv.writer soronként ír; nagy pufferrel ritkán kerül sor tényleges write() hívásra
+    tmp = paths["csv_out"] + ".tmp"
+    with open(tmp, "wb", buffering=CSV_WRITE_BUFFER) as f:
+        _write_csv_rows(f, UNIFIED_FIELDNAMES, rows, max_extra)
+    os.replace(tmp, paths["csv_out"])
+    return paths["csv_out"]
+
+def _retry_build_rows(display_name: str, canon: Set[str], ctx: ExportCtx, max_tries: int = 3,
+                      pages: Optional[List[Dict]] = None,
+                      cancel: Optional[threading.Event] = None) -> Tuple[List[List[str]], int]:
+    """Felépíti a unified sorokat egy kurzushoz (pozicionálisan: UNIFIED_FIELDNAMES, majd a tartalom folytatásai).
+    Visszaad: sorok, újrapróbálások száma."""
     last_exc = None
     for attempt in range(1, max_tries + 1):
+        if cancel is not None and cancel.is_set():
+            return [], attempt - 1
         try:
-            rows: List[Dict[str, str]] = []
-            pages = _pages_for_group(display_name, canon)
-            for pg in pages:
-                base, section_type = _row_from_page(pg)
-                row = {
-                    "course": display_name,
-                    "oldal_cime": base["oldal_cime"],
-                    "szakasz": base["szakasz"],
-                    "sorszam": base["sorszam"],
-                    "section_type": section_type or "",
-                    "tartalom": base["tartalom"],
-                }
-                chunks = _split_content_for_csv(row.get("tartalom", ""), MAX_CONTENT_CHARS)
-                row.pop("tartalom", None)
-                row.update(chunks)
-                rows.append(row)
+            rows: List[List[str]] = []
+            group_pages = pages if pages is not None else _pages_for_group(display_name, canon)
+            for base, section_type in _rows_from_pages(group_pages, ctx):
+                rows.append([display_name, base["oldal_cime"], base["szakasz"], base["sorszam"], section_type or "",
+                             *_split_content_parts(base["tartalom"], MAX_CONTENT_CHARS)])
             return rows, (attempt - 1)
-        except APIResponseError as e:
+        except HTTPResponseError as e:
             last_exc = e
-            if getattr(e, "status", None) not in (429, 500, 502, 503):
+            if getattr(e, "status", None) not in _TRANSIENT_STATUS:
                 break
         except Exception as e:
             last_exc = e
@@ -738,22 +1057,40 @@ def _retry_build_rows(display_name: str, canon: Set[str], max_tries: int = 3) ->
     # hiba: üres listával térünk vissza
     return [], (max_tries - 1)
 
+_STATUS_ICONS = {"done": "🟢 Kész", "running": "🟡 Folyamatban…", "error": "🔴 Hiba", "pending": "⚪ Várakozik"}
+_STATUS_PROGRESS = {"running": 0.3, "done": 1.0, "error": 0.0, "pending": 0.0}
+# az összesítő sáv legfeljebb ennyi másodpercenként rajzolódik újra (a végén mindig)
+UI_MIN_INTERVAL = 0.25
+
 class ProgressUI:
-    def __init__(self, run_id: str, ordered: List[Tuple[str,int,Set[str]]], title: str):
+    def __init__(self, run_id: str, ordered: List[Tuple[str,int,Set[str]]], title: str, cp: dict):
         self.run_id = run_id
         self.total = len(ordered)
         self.rows = {}
+        # render-ritkítás: soronként és összesítve az utoljára kirajzolt állapot
+        self._last_status: Dict[str, str] = {}
+        self._last_global: Optional[tuple] = None
+        self._last_global_t = 0.0
+        # a "running" állapotot a workerek állítják (_marked_running), a többit a fő szál
+        self._lock = threading.Lock()
         st.markdown(f"### {title}")
         self.global_progress_placeholder = st.empty()
         self.eta_placeholder = st.empty()
         self.grid = st.container()
 
-        cp = _load_checkpoint(run_id) or {}
+        # a hívó már betöltötte a checkpointot (ZIP és egylapos futásnál más-más fájlból), nem olvassuk újra
         completed = set(cp.get("completed", []))
         failed = set(cp.get("failed", []))
 
         with self.grid:
+            # folytatáskor a már kész csoportok egyetlen összesítőbe kerülnek (nem kapnak saját sort/sávot)
+            done_items = [(name, count) for name, count, _ in ordered if name in completed]
+            if done_items:
+                with st.expander(f"🟢 Már kész: {len(done_items)} csoport ({sum(int(c) for _, c in done_items)} oldal)"):
+                    st.markdown("\n".join(f"- **{name}** ({int(count)} oldal)" for name, count in done_items))
             for name, count, _ in ordered:
+                if name in completed:
+                    continue
                 ph = st.container(border=True)
                 with ph:
                     col1, col2 = st.columns([0.6, 0.4])
@@ -765,37 +1102,39 @@ class ProgressUI:
                             "pbar": st.progress(0.0),
                             "note": st.empty(),
                         }
-                if name in completed:
-                    self.set_status(name, "done")
-                elif name in failed:
+                if name in failed:
                     self.set_status(name, "error")
                 else:
                     self.set_status(name, "pending")
 
-        self.update_global(cp)
+        self.update_global(cp, force=True)
 
     def set_status(self, name: str, status: str, note: str = ""):
-        icons = {"done": "🟢 Kész", "running": "🟡 Folyamatban…", "error": "🔴 Hiba", "pending": "⚪ Várakozik"}
-        row = self.rows[name]
-        row["status"].markdown(f"**Állapot:** {icons.get(status, status)}")
-        if status == "running":
-            row["pbar"].progress(0.3)
-        elif status == "done":
-            row["pbar"].progress(1.0)
-        elif status == "error":
-            row["pbar"].progress(0.0)
-        else:
-            row["pbar"].progress(0.0)
-        if note:
-            row["note"].write(note)
-
-    def update_global(self, cp: dict):
+        # változatlan állapotot (megjegyzés nélkül) nem rajzolunk újra
+        with self._lock:
+            if name not in self.rows or (not note and self._last_status.get(name) == status):
+                return
+            self._last_status[name] = status
+            row = self.rows[name]
+            row["status"].markdown(f"**Állapot:** {_STATUS_ICONS.get(status, status)}")
+            row["pbar"].progress(_STATUS_PROGRESS.get(status, 0.0))
+            if note:
+                row["note"].write(note)
+
+    def update_global(self, cp: dict, force: bool = False):
         total = cp.get("total", self.total)
         done = len(cp.get("completed", []))
         retries = int(cp.get("retries", 0))
+        eta_per = cp.get("eta_sec_per_item")
+        key = (done, total, retries, eta_per)
+        if key == self._last_global:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_global_t < UI_MIN_INTERVAL:
+            return
+        self._last_global, self._last_global_t = key, now
         pct = 0.0 if total == 0 else done / total
         self.global_progress_placeholder.progress(pct, text=f"Össz-progressz: {done}/{total} kész ({int(pct*100)}%)")
-        eta_per = cp.get("eta_sec_per_item")
         if eta_per:
             remaining = total - done
             eta_sec = max(0, int(remaining * eta_per))
@@ -816,57 +1155,137 @@ class ProgressUI:
         st.success(txt)
 
 # Eredeti ZIP-es motor (meglévő)
+# egyenkénti letöltés fájlnevéhez: minden, ami nem betű/szám/_-. /szóköz → "_"
+_FNAME_SAFE_RE = re.compile(r"[^\w\-. ]")
+
+_SLUG_DROP_RE = re.compile(r"[^\w\s-]", re.UNICODE)
+_SLUG_SEP_RE = re.compile(r"[\s-]+")
+
 def _slug(s: str) -> str:
     s = s.strip().lower()
-    s = re.sub(r"[^\w\s-]", "", s, flags=re.UNICODE)
-    s = re.sub(r"[\s-]+", "_", s)
+    s = _SLUG_DROP_RE.sub("", s)
+    s = _SLUG_SEP_RE.sub("_", s)
     return s[:80] if len(s) > 80 else s
 
-def _zip_folder(folder: str) -> bytes:
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(folder):
-            for name in sorted(files):
-                if name.endswith(".json") or name.endswith(".txt"):
-                    continue
-                fp = os.path.join(root, name)
-                arcname = os.path.relpath(fp, folder)
-                zf.write(fp, arcname)
-    buf.seek(0)
-    return buf.read()
+_PRECOMPRESSED_EXTS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".gz", ".pdf")
 
-def _write_csv_file(run_id: str, display_name: str, data: bytes) -> str:
-    rd = _run_dir(run_id); _ensure_dir(rd)
-    fn = f"export_{_slug(display_name)}.csv"
-    fp = os.path.join(rd, fn)
-    with open(fp, "wb") as f:
+def _zip_folder(folder: str, zip_path: str) -> str:
+    """A mappa CSV-it közvetlenül fájlba tömöríti (nem memóriába); CSV-nél az 1-es szint is bőven elég.
+    Ideiglenes fájlba ír, és csak a kész archívumot nevezi át zip_path-ra, így félkész ZIP nem kerülhet letöltésre."""
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(zip_path) or ".", suffix=".zip.tmp", delete=False)
+    try:
+        with tmp, zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            for root, _, files in os.walk(folder):
+                for name in sorted(files):
+                    if name.endswith((".json", ".txt", ".zip", ".tmp")):
+                        continue
+                    fp = os.path.join(root, name)
+                    arcname = os.path.relpath(fp, folder)
+                    # eleve tömörített fájlt nem tömörítünk újra
+                    ctype = zipfile.ZIP_STORED if name.lower().endswith(_PRECOMPRESSED_EXTS) else None
+                    zf.write(fp, arcname, compress_type=ctype)
+        os.replace(tmp.name, zip_path)
+    except BaseException:
+        try:
+            os.remove(tmp.name)
+        except OSError:
+            pass
+        raise
+    return zip_path
+
+def _csv_paths(run_id: str, names: List[str]) -> Dict[str, str]:
+    """Csoportnév → CSV útvonal a futáson belül. A slug több nevet is összevonhat ("A B" / "A-B", 80 karakteres
+    levágás); ilyenkor a név rövid hash-e különbözteti meg a fájlokat, így egy fájl mindig egy csoporté."""
+    slugs = {n: _slug(n) for n in names}
+    clash = {sl for sl, c in Counter(slugs.values()).items() if c > 1}
+    rd = _run_dir(run_id)
+    return {
+        n: os.path.join(rd, f"export_{sl}_{hashlib.sha1(n.encode('utf-8')).hexdigest()[:6]}.csv" if sl in clash
+                        else f"export_{sl}.csv")
+        for n, sl in slugs.items()
+    }
+
+def _write_csv_file(fp: str, data: bytes) -> str:
+    """A futás mappáját a hívó (export_engine) egyszer, előre hozza létre. Ideiglenes fájlon át ír,
+    így a meglévő CSV mindig teljes – folytatáskor ebből tudjuk, mi készült el a checkpoint mentése előtt."""
+    tmp = fp + ".tmp"
+    with open(tmp, "wb") as f:
         f.write(data)
+    os.replace(tmp, fp)
     return fp
 
 def _save_checkpoint(run_id: str, state: dict):
-    rd = _run_dir(run_id); _ensure_dir(rd)
-    with open(_checkpoint_path(run_id), "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
-
-def _load_checkpoint(run_id: str) -> Optional[dict]:
+    _write_json_atomic(_checkpoint_path(run_id), state)
+    _LAST_CP_SAVE[run_id] = time.monotonic()
+
+class _RollingMedian:
+    """Az utolsó `n` időtartam mediánja; egy-egy kiugróan lassú csoport nem rántja el az ETA-t."""
+    def __init__(self, values, n: int = 10):
+        self.values = deque(values or [], maxlen=n)
+
+    def add(self, x: float) -> float:
+        self.values.append(x)
+        return statistics.median(self.values)
+
+# run_id → utolsó checkpoint-írás ideje (monotonic)
+_LAST_CP_SAVE: Dict[str, float] = {}
+CHECKPOINT_MIN_INTERVAL = 2.0
+
+def _maybe_save_checkpoint(run_id: str, state: dict, force: bool = False, flush: Optional[Callable[[], None]] = None):
+    """Ritkított mentés: legfeljebb CHECKPOINT_MIN_INTERVAL mp-enként, kivéve force (hiba / futás vége).
+    A flush a mentés előtt fut (pl. a háttér-író kiürítése), hogy a checkpoint ne előzze meg a fájlokat."""
+    if force or time.monotonic() - _LAST_CP_SAVE.get(run_id, 0.0) >= CHECKPOINT_MIN_INTERVAL:
+        if flush:
+            flush()
+        _save_checkpoint(run_id, state)
+
+def _csv_writer_loop(q: "queue.Queue", errors: List[Tuple[str, str]]):
+    """Háttérszál: a sorból érkező (útvonal, név, bájtok) elemeket lemezre írja; None = leállás."""
+    while True:
+        item = q.get()
+        try:
+            if item is None:
+                return
+            fp, name, data = item
+            try:
+                _write_csv_file(fp, data)
+            except Exception as e:
+                errors.append((name, repr(e)))
+        finally:
+            q.task_done()
+
+def _load_checkpoint(run_id: str, allow_stale: bool = False) -> Optional[dict]:
+    """Elavult (CHECKPOINT_MAX_AGE_H-nál régebbi) checkpointot csak allow_stale-lel adunk vissza."""
     try:
-        with open(_checkpoint_path(run_id), "r", encoding="utf-8") as f:
-            return json.load(f)
+        cp = _json_load_file(_checkpoint_path(run_id))
     except Exception:
         return None
+    return None if cp and not allow_stale and _checkpoint_stale(cp) else cp
 
-def _retry_export_one(display_name: str, canon_set: Set[str], export_one_fn, run_id: str, max_tries: int = 3):
+def _marked_running(ui: "ProgressUI", name: str, cancel: threading.Event, fn, *args):
+    """Worker-oldali indítás: a csoport akkor kap "running" állapotot, amikor egy szál ténylegesen elkezdi
+    (a sorban állók "pending"-ek maradnak; egyszerre csak EXPORT_WORKERS csoport fut)."""
+    if not cancel.is_set():
+        ui.set_status(name, "running")
+    return fn(*args)
+
+def _retry_export_one(display_name: str, canon_set: Set[str], export_one_fn, run_id: str, max_tries: int = 3,
+                      cancel: Optional[threading.Event] = None):
     last_exc = None
     for attempt in range(1, max_tries + 1):
+        if cancel is not None and cancel.is_set():
+            # a futás leállt (hibaküszöb); a csoport függőben marad, folytatáskor újra sorra kerül
+            _append_log(run_id, f"CANCELLED {display_name}")
+            return None, attempt-1
         try:
             _append_log(run_id, f"START {display_name} (attempt {attempt}/{max_tries})")
             data = export_one_fn(display_name, canon_set)
             _append_log(run_id, f"SUCCESS {display_name}")
             return data, attempt-1
-        except APIResponseError as e:
+        except HTTPResponseError as e:
             last_exc = e
             _append_log(run_id, f"API ERROR {display_name}: {getattr(e, 'status', '?')} – {e!r}")
-            if getattr(e, "status", None) not in (429, 500, 502, 503):
+            if getattr(e, "status", None) not in _TRANSIENT_STATUS:
                 break
         except Exception as e:
             last_exc = e
@@ -875,10 +1294,25 @@ def _retry_export_one(display_name: str, canon_set: Set[str], export_one_fn, run
     _append_log(run_id, f"FINAL FAIL {display_name}: {last_exc!r}")
     return None, max_tries-1
 
+def _smallest_first(groups: List[Tuple[str,int,Set[str]]]) -> List[Tuple[str,int,Set[str]]]:
+    """Futási sorrend: a legkevesebb oldalas csoport elöl (holtversenyben név szerint)."""
+    return sorted(groups, key=lambda t: (t[1], t[0]))
+
+def _display_list_state(ordered: List[Tuple[str,int,Set[str]]]) -> List[list]:
+    return [[name, int(count), sorted(canon)] for name, count, canon in ordered]
+
+def _run_groups(cp: dict, groups_display: List[Tuple[str,int,Set[str]]]) -> List[Tuple[str,int,Set[str]]]:
+    """A futás a saját, induláskor rögzített csoportlistáján megy végig; folytatáskor a közben
+    újraszámolt lista (új/átnevezett kurzus) nem borítja a total-t és a sorrendet."""
+    saved = cp.get("display_list")
+    if not saved:
+        return _smallest_first(groups_display)
+    return [(name, count, set(canon)) for name, count, canon in saved]
+
 def _init_run(groups_display: List[Tuple[str,int,Set[str]]]):
     run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
     rd = _run_dir(run_id); _ensure_dir(rd)
-    ordered = sorted(groups_display, key=lambda t: (t[1], t[0]))
+    ordered = _smallest_first(groups_display)
     state = {
         "run_id": run_id,
         "created_at": datetime.now().isoformat(),
@@ -889,86 +1323,177 @@ def _init_run(groups_display: List[Tuple[str,int,Set[str]]]):
         "total": len(ordered),
         "eta_sec_per_item": None,
         "durations": [],
+        "display_list": _display_list_state(ordered),
     }
     _save_checkpoint(run_id, state)
     _append_log(run_id, "=== ÚJ FUTÁS INDULT ===")
     return run_id, state
 
+def _checkpoint_age_h(cp: dict) -> Optional[float]:
+    try:
+        created = datetime.fromisoformat(cp.get("created_at") or "")
+    except ValueError:
+        return None
+    return (datetime.now() - created).total_seconds() / 3600
+
+def _checkpoint_stale(cp: dict) -> bool:
+    age = _checkpoint_age_h(cp)
+    return age is not None and age > CHECKPOINT_MAX_AGE_H
+
+def _run_age_notice(cp: dict) -> bool:
+    """A futás korának kiírása a tab tetején. Elavult futásnál figyelmeztet és False-t ad:
+    azt újrarajzoláskor sem folytatjuk automatikusan, a gomb új futást indít."""
+    age = _checkpoint_age_h(cp)
+    if age is None:
+        return True
+    age_txt = f"{age:.0f} órás" if age >= 1 else f"{int(age * 60)} perces"
+    if age > CHECKPOINT_MAX_AGE_H:
+        st.warning(f"A legutóbbi export ({age_txt}) elavult, nem folytatjuk – az export gomb új futást indít.")
+        return False
+    if len(cp.get("completed", [])) < cp.get("total", 0):
+        st.info(f"Van folytatható export ({age_txt}).")
+    return True
+
 def _resume_or_new_run(groups_display: List[Tuple[str,int,Set[str]]]):
     run_id = st.session_state.get("current_run_id")
     if run_id:
-        cp = _load_checkpoint(run_id)
-        if cp: 
+        cp = _load_checkpoint(run_id, allow_stale=True)
+        if cp and _checkpoint_stale(cp):
+            _append_log(run_id, "=== ELAVULT CHECKPOINT, ÚJ FUTÁS INDUL ===")
+        elif cp:
             return run_id, cp
     run_id, cp = _init_run(groups_display)
     st.session_state["current_run_id"] = run_id
     return run_id, cp
 
-def export_engine(run_id: str, groups_display: List[Tuple[str,int,Set[str]]]):
-    ordered = sorted(groups_display, key=lambda t: (t[1], t[0]))
-    cp = _load_checkpoint(run_id)
+def export_engine(run_id: str, groups_display: List[Tuple[str,int,Set[str]]], cp: Optional[dict] = None):
+    cp = cp or _load_checkpoint(run_id)
     if not cp:
-        cp = {
-            "run_id": run_id,
-            "created_at": datetime.now().isoformat(),
-            "completed": [],
-            "pending": [d for d,_,_ in ordered],
-            "failed": [],
-            "retries": 0,
-            "total": len(ordered),
-            "eta_sec_per_item": None,
-            "durations": []
-        }
-        _save_checkpoint(run_id, cp)
-
-    ui = ProgressUI(run_id, ordered, title="Külön CSV-k (ZIP) – folyamat")
-
+        # hiányzó vagy elavult checkpoint: új futás (a régi mappát nem írjuk felül)
+        run_id, cp = _init_run(groups_display)
+        st.session_state["current_run_id"] = run_id
+    ordered = _run_groups(cp, groups_display)
+
+    ui = ProgressUI(run_id, ordered, title="Külön CSV-k (ZIP) – folyamat", cp=cp)
+    ctx = ExportCtx.build(bool(st.session_state.get("use_page_cache", False)))
+    cp["completed"] = set(cp.get("completed", []))
+    cp["failed"] = set(cp.get("failed", []))
+    durs = _RollingMedian(cp.get("durations"))
+    cp["durations"] = durs.values
+
+    csv_paths = _csv_paths(run_id, [name for name, _, _ in ordered])
+    pending: List[Tuple[str, Set[str]]] = []
     for name, count, canon in ordered:
         if name in cp["completed"]:
             ui.set_status(name, "done")
-            continue
+        elif os.path.exists(csv_paths[name]):
+            # a CSV kiírása megtörtént, csak a (ritkított) checkpoint-mentés maradt el: nem exportáljuk újra
+            cp["completed"].add(name)
+            cp["failed"].discard(name)
+            ui.set_status(name, "done")
+        else:
+            pending.append((name, canon))
+    # "pending" = még nem kész (a hibásak is); élő halmaz, mint a completed/failed, a mentés rendezi
+    cp["pending"] = {name for name, _ in pending}
+
+    # a csoportok párhuzamosan futnak (I/O-kötött Notion hívások); a checkpoint és
+    # a UI frissítése kizárólag ezen a szálon, as_completed sorrendben történik
+    # kész futás újrarajzolásakor (pl. rerun, új session) nincs mit lekérdezni
+    pages_by_group = _prefetched_pages("zip", run_id, ordered) if pending else {}
+    export_fn = lambda d, c: export_one(d, c, ctx, pages=pages_by_group.get(d))
+    # a CSV-k lemezre írása külön szálon megy, így a lassú FS nem tartja fel a következő csoportot
+    write_q: "queue.Queue" = queue.Queue()
+    _ensure_dir(_run_dir(run_id))
+    write_errors: List[Tuple[str, str]] = []
+    threading.Thread(target=_csv_writer_loop, args=(write_q, write_errors), daemon=True).start()
+    # hibaküszöb: ha a csoportok túl nagy része bukik (pl. auth/séma hiba), a maradékot nem indítjuk el
+    cancel = threading.Event()
+    fail_limit = max(FAIL_FAST_MIN, int(FAIL_FAST_RATIO * len(ordered)))
+    # csak az ebben a futásban bukott csoportok számítanak (a checkpoint "failed" korábbi futásokét is tartalmazza)
+    failed_now = 0
+    halted = False
+    t_last = time.time()
+    ex = _thread_pool(min(EXPORT_WORKERS, len(pending)))
+    try:
+        futures = {ex.submit(_marked_running, ui, name, cancel, _retry_export_one, name, canon, export_fn, run_id, 3, cancel): name
+                   for name, canon in pending}
 
-        ui.set_status(name, "running")
-        t0 = time.time()
-        data, retry_count = _retry_export_one(name, canon, export_one, run_id, max_tries=3)
-        cp["retries"] = int(cp.get("retries", 0)) + retry_count
-
-        if data is None:
-            cp["failed"] = sorted(set(cp.get("failed", [])) | {name})
-            _save_checkpoint(run_id, cp)
-            ui.set_status(name, "error", note="Hibás export. Automatikus folytatás során újrapróbáljuk.")
-            continue
+        for fut in as_completed(futures):
+            name = futures[fut]
+            data, retry_count = fut.result()
+            cp["retries"] = int(cp.get("retries", 0)) + retry_count
 
-        _write_csv_file(run_id, name, data)
-        elapsed = max(0.1, time.time() - t0)
-        durs = cp.get("durations", [])
-        durs.append(elapsed)
-        if len(durs) > 10:
-            durs = durs[-10:]
-        cp["durations"] = durs
-        cp["eta_sec_per_item"] = sum(durs) / len(durs)
-
-        cp["completed"] = sorted(set(cp.get("completed", [])) | {name})
-        if name in cp.get("failed", []):
-            cp["failed"] = [x for x in cp["failed"] if x != name]
-        _save_checkpoint(run_id, cp)
+            if data is None and cancel.is_set():
+                ui.set_status(name, "pending")
+                continue
+            if data is None:
+                failed_now += 1
+                cp["failed"].add(name)
+                _maybe_save_checkpoint(run_id, cp, force=True, flush=write_q.join)
+                ui.set_status(name, "error", note="Hibás export. Automatikus folytatás során újrapróbáljuk.")
+                if failed_now > fail_limit:
+                    # a még várakozó feladatok az első próbálkozás előtt kilépnek (_retry_export_one);
+                    # shutdown(cancel_futures=True) itt nem jó, mert az as_completed nem kapna értesítést
+                    halted = True
+                    cancel.set()
+                    _append_log(run_id, f"=== LEÁLLÍTVA: {failed_now} hibás csoport (küszöb: {fail_limit}) ===")
+                continue
 
-        ui.set_status(name, "done")
-        ui.update_global(cp)
+            write_q.put((csv_paths[name], name, data))
+            # két befejezés között eltelt idő = tényleges átfutás/elem párhuzamos futásnál is
+            now = time.time()
+            elapsed = max(0.1, now - t_last)
+            t_last = now
+            cp["eta_sec_per_item"] = durs.add(elapsed)
 
+            cp["completed"].add(name)
+            cp["pending"].discard(name)
+            cp["failed"].discard(name)
+            _maybe_save_checkpoint(run_id, cp, flush=write_q.join)
+
+            ui.set_status(name, "done")
+            ui.update_global(cp)
+    finally:
+        # rerun/leállítás (RerunException a következő UI-hívásnál) vagy hiba: a sorban álló csoportokat
+        # nem indítjuk el és nem várjuk meg, csak a már futókat; az író szálat is leállítjuk,
+        # és a már kiírt csoportokat elmentjük
+        cancel.set()
+        ex.shutdown(cancel_futures=True)
+        write_q.put(None)
+        write_q.join()
+        for name, err in write_errors:
+            # sikertelen lemezírás: a csoport nem kész, folytatáskor újra sorra kerül
+            cp["completed"].discard(name)
+            cp["pending"].add(name)
+            cp["failed"].add(name)
+            _append_log(run_id, f"WRITE ERROR {name}: {err}")
+        _save_checkpoint(run_id, cp)
+    for name, _ in write_errors:
+        ui.set_status(name, "error", note="A CSV fájl írása nem sikerült.")
+    if write_errors:
+        st.warning("Fájlírási hibák: " + ", ".join(n for n, _ in write_errors))
+    ui.update_global(cp, force=True)
+    if halted:
+        st.error(f"Leállítva hibaküszöb miatt: {failed_now} csoport hibás. Ellenőrizd a tokent / adatbázis sémát, majd folytasd.")
     done = len(cp.get("completed", []))
     total = cp.get("total", len(ordered))
     if done == total:
-        zip_bytes = _zip_folder(_run_dir(run_id))
+        _drop_prefetched_pages("zip", run_id)
+        zip_name = f"notion_kurzus_export_{run_id}.zip"
+        zip_path = os.path.join(_run_dir(run_id), zip_name)
+        # kész futásnál a CSV-k már nem változnak: rerunkor a meglévő ZIP-et adjuk, nem tömörítünk újra
+        if not os.path.exists(zip_path):
+            _zip_folder(_run_dir(run_id), zip_path)
         st.success("Export kész!")
         ui.summary_box(cp)
-        st.download_button("ZIP letöltése", data=zip_bytes, file_name=f"notion_kurzus_export_{run_id}.zip", mime="application/zip")
+        with open(zip_path, "rb") as zf:
+            st.download_button("ZIP letöltése", data=zf, file_name=zip_name, mime="application/zip", key=f"dl-zip-{run_id}")
         _append_log(run_id, "=== KÉSZ ===")
 
 # Unified run init/resume
 def _init_unified_run(groups_display: List[Tuple[str,int,Set[str]]]):
     run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    ordered = sorted(groups_display, key=lambda t: (t[1], t[0]))
+    ordered = _smallest_first(groups_display)
     state = {
         "run_id": run_id,
         "created_at": datetime.now().isoformat(),
@@ -980,6 +1505,7 @@ def _init_unified_run(groups_display: List[Tuple[str,int,Set[str]]]):
         "rows_written": 0,
         "eta_sec_per_item": None,   # per group ETA
         "durations": [],
+        "display_list": _display_list_state(ordered),
     }
     _save_unified_cp(run_id, state)
     # üresítsük az NDJSON-t
@@ -992,73 +1518,96 @@ def _init_unified_run(groups_display: List[Tuple[str,int,Set[str]]]):
 def _resume_or_new_unified(groups_display: List[Tuple[str,int,Set[str]]]):
     run_id = st.session_state.get("unified_run_id")
     if run_id:
-        cp = _load_unified_cp(run_id)
-        if cp:
+        cp = _load_unified_cp(run_id, allow_stale=True)
+        if cp and _checkpoint_stale(cp):
+            _append_log(run_id, "=== ELAVULT CHECKPOINT, ÚJ FUTÁS INDUL ===")
+        elif cp:
             return run_id, cp
     return _init_unified_run(groups_display)
 
-def unified_export_engine(run_id: str, groups_display: List[Tuple[str,int,Set[str]]]):
-    ordered = sorted(groups_display, key=lambda t: (t[1], t[0]))
-    cp = _load_unified_cp(run_id)
+def unified_export_engine(run_id: str, groups_display: List[Tuple[str,int,Set[str]]], cp: Optional[dict] = None):
+    cp = cp or _load_unified_cp(run_id)
     if not cp:
-        # ha checkpoint hiányzik (pl. törölt fájl), újraindítjuk
+        # ha checkpoint hiányzik (pl. törölt fájl) vagy elavult, újraindítjuk
         run_id, cp = _init_unified_run(groups_display)
+    ordered = _run_groups(cp, groups_display)
 
-    ui = ProgressUI(run_id, ordered, title="Egy munkalap (CSV) – folyamat")
+    _ensure_dir(_run_dir(run_id))
+    ui = ProgressUI(run_id, ordered, title="Egy munkalap (CSV) – folyamat", cp=cp)
+    ctx = ExportCtx.build(bool(st.session_state.get("use_page_cache", False)))
 
-    completed_set = set(cp.get("completed", []))
-    failed_set = set(cp.get("failed", []))
+    # az NDJSON hozzáfűzéssel szinkronban kell maradnia, ezért itt minden csoport után mentünk
+    cp["completed"] = set(cp.get("completed", []))
+    cp["failed"] = set(cp.get("failed", []))
+    durs = _RollingMedian(cp.get("durations"))
+    cp["durations"] = durs.values
 
+    pending: List[Tuple[str, Set[str]]] = []
     for name, count, canon in ordered:
-        if name in completed_set:
+        if name in cp["completed"]:
             ui.set_status(name, "done")
-            continue
-        if name in failed_set:
+        elif name in cp["failed"]:
             ui.set_status(name, "error")
-            continue
-
-        ui.set_status(name, "running")
-        t0 = time.time()
-        rows, retry_count = _retry_build_rows(name, canon, max_tries=3)
-        cp["retries"] = int(cp.get("retries", 0)) + retry_count
-
-        if not rows:
-            # jelöljük hibásnak, de megyünk tovább
-            cp["failed"] = sorted(set(cp.get("failed", [])) | {name})
-            _save_unified_cp(run_id, cp)
-            ui.set_status(name, "error", note="Hiba történt, később újrapróbálható.")
-            continue
+        else:
+            pending.append((name, canon))
+    pages_by_group = _prefetched_pages("unified", run_id, ordered) if pending else {}
+
+    # a csoportok sorai párhuzamosan készülnek, de beküldési sorrendben kerülnek az NDJSON-ba,
+    # így a végső munkalap csoportsorrendje nem függ attól, melyik szál végez előbb
+    t_last = time.time()
+    cancel = threading.Event()
+    ex = _thread_pool(min(EXPORT_WORKERS, len(pending)))
+    try:
+        futures = [(name, ex.submit(_marked_running, ui, name, cancel, _retry_build_rows, name, canon, ctx, 3,
+                                    pages_by_group.get(name), cancel))
+                   for name, canon in pending]
+
+        for name, fut in futures:
+            rows, retry_count = fut.result()
+            cp["retries"] = int(cp.get("retries", 0)) + retry_count
+
+            if not rows:
+                # jelöljük hibásnak, de megyünk tovább
+                cp["failed"].add(name)
+                _save_unified_cp(run_id, cp)
+                ui.set_status(name, "error", note="Hiba történt, később újrapróbálható.")
+                continue
 
-        # kiírás NDJSON-ba
-        written = _append_unified_rows(run_id, rows)
-        cp["rows_written"] = int(cp.get("rows_written", 0)) + written
+            # kiírás NDJSON-ba
+            written = _append_unified_rows(run_id, rows)
+            cp["rows_written"] = int(cp.get("rows_written", 0)) + written
 
-        # ETA frissítés (mozgó átlag az utolsó 10 csoportból)
-        elapsed = max(0.1, time.time() - t0)
-        durs = list(cp.get("durations", []))
-        durs.append(elapsed)
-        if len(durs) > 10:
-            durs = durs[-10:]
-        cp["durations"] = durs
-        cp["eta_sec_per_item"] = sum(durs) / len(durs)
+            # ETA frissítés (az utolsó 10 csoport mediánja; két befejezés között eltelt idő)
+            now = time.time()
+            elapsed = max(0.1, now - t_last)
+            t_last = now
+            cp["eta_sec_per_item"] = durs.add(elapsed)
 
-        # kész
-        cp["completed"] = sorted(set(cp.get("completed", [])) | {name})
-        if name in cp.get("failed", []):
-            cp["failed"] = [x for x in cp["failed"] if x != name]
-        _save_unified_cp(run_id, cp)
+            # kész
+            cp["completed"].add(name)
+            cp["failed"].discard(name)
+            _save_unified_cp(run_id, cp)
 
-        ui.set_status(name, "done")
-        ui.update_global(cp)
+            ui.set_status(name, "done")
+            ui.update_global(cp)
+    finally:
+        # rerun/leállítás vagy hiba esetén a még el nem indult csoportokat eldobjuk (folytatáskor újra sorra kerülnek)
+        cancel.set()
+        ex.shutdown(cancel_futures=True)
 
+    ui.update_global(cp, force=True)
     done = len(cp.get("completed", []))
     total = cp.get("total", len(ordered))
     if done == total:
-        data = _finalize_unified_csv(run_id)
+        _drop_prefetched_pages("unified", run_id)
+        csv_path = _unified_paths(run_id)["csv_out"]
+        if not os.path.exists(csv_path):
+            _finalize_unified_csv(run_id)
         extra = f"Összes előállított sor: {cp.get('rows_written', 0)}"
         ui.summary_box(cp, extra=extra)
         filename = f"Content_egylap_{run_id}.csv"
-        st.download_button("Letöltés: " + filename, data=data, file_name=filename, mime="text/csv")
+        with open(csv_path, "rb") as cf:
+            st.download_button("Letöltés: " + filename, data=cf, file_name=filename, mime="text/csv", key=f"dl-unified-{run_id}")
 
 # ────────────────────────────────────────────────────────────────────────────────
 # UI – main (tabokba rendezve a letöltéseket)
@@ -1086,9 +1635,9 @@ if not items:
     st.info("Nem találtam csoportokat a megadott PROPERTY_NAME alapján.")
     st.stop()
 
-labels = [f"{name} ({cnt})" for name, cnt, _ in items]
-name_by_label = {f"{name} ({cnt})": name for name, cnt, _ in items}
-canon_by_name = {name: canon for name, _, canon in items}
+# címke → (név, kanonikus nevek); rerunonként építjük (olcsóbb, mint bármilyen kulcs a listára)
+items_idx: Dict[str, Tuple[str, frozenset]] = {f"{name} ({cnt})": (name, frozenset(canon)) for name, cnt, canon in items}
+labels = list(items_idx)
 
 with st.expander("Csoportok listája"):
     st.write(", ".join(labels))
@@ -1100,6 +1649,13 @@ with st.expander("Részletek (felismert mezők és rendezés)"):
     st.write(f"**Sorszám mező**: `{ord_prop or '— (nincs; ABC cím szerint rendezünk)'}`")
     st.write(f"**Rendezés**: {sorts_desc}")
     st.write(f"**MAX_CONTENT_CHARS**: `{MAX_CONTENT_CHARS}`")
+    st.checkbox("Lemezes oldal-cache (változatlan oldalt nem töltünk le újra)", value=True, key="use_page_cache")
+    # séma/oldallista (és oldal-) cache kézi ürítése (pl. átnevezett opció vagy új oldal után)
+    if st.button("Cache frissítése"):
+        st.cache_data.clear()
+        _scan_database.clear()
+        get_page_cache().clear()
+        st.rerun()
 
 tab1, tab2 = st.tabs(["Külön CSV-k (ZIP)", "Egy munkalap (CSV)"])
 
@@ -1109,10 +1665,11 @@ with tab1:
         if not pick:
             st.warning("Válassz legalább egy elemet.")
         else:
+            token = schema_version_token()
             for lbl in pick:
-                name = name_by_label[lbl]
-                data = export_one(name, canon_by_name[name])
-                fname_safe = re.sub(r"[^\w\-. ]", "_", name).strip().replace(" ", "_")
+                name, canon = items_idx[lbl]
+                data = export_one_cached(name, canon, token, bool(st.session_state.get("use_page_cache", False)))
+                fname_safe = _FNAME_SAFE_RE.sub("_", name).strip().replace(" ", "_")
                 st.download_button(
                     label=f"Letöltés: {name}.csv",
                     data=data,
@@ -1126,27 +1683,28 @@ with tab1:
     start_run = st.button("Exportálás – Összes (ZIP)", type="primary", use_container_width=True)
 
     def _resume_or_render(run_id: Optional[str]):
-        if run_id and _load_checkpoint(run_id):
-            export_engine(run_id, items)
-
-    _resume_or_render(st.session_state.get("current_run_id"))
+        # a betöltött checkpointot a motor is megkapja (nem olvassuk be kétszer)
+        cp = _load_checkpoint(run_id, allow_stale=True) if run_id else None
+        if cp and _run_age_notice(cp):
+            export_engine(run_id, items, cp)
 
+    # egyetlen belépési pont: gombnyomásra előbb létrejön/folytatódik a futás, a motor pedig
+    # rerunonként egyszer fut (korábban gombnyomáskor kétszer rajzolt ki mindent)
     if start_run:
-        run_id, cp = _resume_or_new_run(items)
+        run_id, _ = _resume_or_new_run(items)
         st.info(f"Futás azonosító: `{run_id}`")
-        export_engine(run_id, items)
+    _resume_or_render(st.session_state.get("current_run_id"))
 
 with tab2:
     st.write("Minden kurzus egyetlen táblában, Google Sheets-barát oszlopokkal.")
     start_unified = st.button("Exportálás – Egy munkalap (minden kurzus együtt)", type="primary", use_container_width=True)
 
     def _resume_or_render_unified(run_id: Optional[str]):
-        if run_id and _load_unified_cp(run_id):
-            unified_export_engine(run_id, items)
-
-    _resume_or_render_unified(st.session_state.get("unified_run_id"))
+        cp = _load_unified_cp(run_id, allow_stale=True) if run_id else None
+        if cp and _run_age_notice(cp):
+            unified_export_engine(run_id, items, cp)
 
     if start_unified:
-        urun_id, ucp = _resume_or_new_unified(items)
+        urun_id, _ = _resume_or_new_unified(items)
         st.info(f"Futás azonosító: `{urun_id}`")
-        unified_export_engine(urun_id, items)
+    _resume_or_render_unified(st.session_state.get("unified_run_id"))